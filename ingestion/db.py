@@ -0,0 +1,34 @@
+import os
+import psycopg2
+
+# ---------------------- Constantes ----------------------
+
+CONNECT_TIMEOUT = 10
+
+
+def get_connection(connect_timeout=CONNECT_TIMEOUT, statement_timeout_ms=None, **kwargs):
+    """
+    Abre una conexión a la base de datos de Supabase usando los secrets de entorno.
+
+    Args:
+        connect_timeout (int, optional): Segundos máximos para conectar. Por defecto, CONNECT_TIMEOUT.
+        statement_timeout_ms (int, optional): Si se indica, Postgres cancela las
+            consultas que tarden más de estos milisegundos.
+        **kwargs: Parámetros extra para psycopg2.connect.
+
+    Returns:
+        connection: Conexión de psycopg2 lista para usar.
+    """
+    if statement_timeout_ms is not None:
+        kwargs["options"] = f"-c statement_timeout={statement_timeout_ms}"
+
+    return psycopg2.connect(
+        host="aws-1-eu-north-1.pooler.supabase.com",
+        dbname="postgres",
+        user="postgres.prwcramdanblevcpaghy",
+        password=os.getenv("DB_PASSWORD"),
+        port=5432,
+        sslmode="require",
+        connect_timeout=connect_timeout,
+        **kwargs
+    )
@@ -0,0 +1,204 @@
+from datetime import datetime, timedelta, timezone
+
+# ---------------------- Constantes ----------------------
+
+# current_user_recently_played solo devuelve las últimas 50 reproducciones
+WINDOW = 50
+
+# El workflow se lanza cada 5 minutos; el script decide si le toca ejecutar
+MIN_INTERVAL_MIN = 5
+
+# El ritmo estimado solo mira hacia atrás: tras un rato sin escuchar, una sesión
+# de canciones cortas o saltos (hasta ~1.5 reproducciones/min) debe caber en la
+# ventana antes de la siguiente lectura, con un 10 % de margen (30 min)
+WORST_CASE_RATE = 1.5
+MAX_INTERVAL_MIN = int(0.9 * WINDOW / WORST_CASE_RATE)
+
+# Fracción de la ventana que dejamos llenar antes de volver a leer
+SAFETY = 0.5
+
+RATE_WINDOWS_MIN = (60, 180)
+
+
+# ---------------------- Tablas de control ----------------------
+
+def ensure_tables(cur):
+    """
+    Crea, si no existen, las tablas de control del scheduler.
+
+    Args:
+        cur (cursor): Cursor de psycopg2.
+
+    Returns:
+        None
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS spotify_ingestion_runs (
+            run_at            timestamptz PRIMARY KEY DEFAULT now(),
+            fetched           integer NOT NULL,
+            new_rows          integer NOT NULL,
+            play_rate         double precision,
+            next_interval_min integer NOT NULL
+        );
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS spotify_history_gaps (
+            id          serial PRIMARY KEY,
+            detected_at timestamptz NOT NULL DEFAULT now(),
+            gap_start   timestamptz NOT NULL,
+            gap_end     timestamptz NOT NULL,
+            recovered   integer NOT NULL,
+            filled      boolean NOT NULL
+        );
+    """)
+
+
+# ---------------------- Estimación del ritmo de escucha ----------------------
+
+def estimate_play_rate(cur, now=None):
+    """
+    Estima el ritmo de escucha (reproducciones por minuto) a partir de lo ya ingerido.
+
+    Usa el máximo entre varias ventanas para reaccionar rápido a picos de escucha
+    sin olvidar el ritmo de las últimas horas.
+
+    Args:
+        cur (cursor): Cursor de psycopg2.
+        now (datetime, optional): Instante de referencia. Por defecto, ahora (UTC).
+
+    Returns:
+        float: Reproducciones por minuto estimadas.
+    """
+    now = now or datetime.now(timezone.utc)
+    rates = []
+    for minutes in RATE_WINDOWS_MIN:
+        cur.execute(
+            "SELECT count(*) FROM spotify_recently_played WHERE played_at >= %s",
+            (now - timedelta(minutes=minutes),)
+        )
+        rates.append(cur.fetchone()[0] / minutes)
+    return max(rates)
+
+
+def next_interval(play_rate):
+    """
+    Calcula cuántos minutos esperar hasta la próxima lectura.
+
+    Args:
+        play_rate (float): Reproducciones por minuto estimadas.
+
+    Returns:
+        int: Minutos hasta la próxima ejecución, entre MIN_INTERVAL_MIN y MAX_INTERVAL_MIN.
+    """
+    if play_rate <= 0:
+        return MAX_INTERVAL_MIN
+    interval = SAFETY * WINDOW / play_rate
+    return int(min(MAX_INTERVAL_MIN, max(MIN_INTERVAL_MIN, interval)))
+
+
+# ---------------------- Registro de ejecuciones y huecos ----------------------
+
+def is_due(cur, now=None):
+    """
+    Indica si toca ejecutar según el intervalo calculado en la última ejecución.
+
+    Args:
+        cur (cursor): Cursor de psycopg2.
+        now (datetime, optional): Instante de referencia. Por defecto, ahora (UTC).
+
+    Returns:
+        bool: True si no hay ejecuciones previas o si ya ha pasado el intervalo.
+    """
+    now = now or datetime.now(timezone.utc)
+    cur.execute(
+        "SELECT run_at, next_interval_min FROM spotify_ingestion_runs ORDER BY run_at DESC LIMIT 1"
+    )
+    last = cur.fetchone()
+    if last is None:
+        return True
+    run_at, interval_min = last
+    # Margen de un minuto por el retraso con el que arranca el cron de GitHub
+    return now >= run_at + timedelta(minutes=interval_min - 1)
+
+
+def record_run(cur, fetched, new_rows, play_rate, interval_min):
+    """
+    Registra una ejecución y el intervalo elegido para la siguiente.
+
+    Args:
+        cur (cursor): Cursor de psycopg2.
+        fetched (int): Reproducciones devueltas por la API.
+        new_rows (int): Reproducciones que no estaban en la base de datos.
+        play_rate (float): Reproducciones por minuto estimadas.
+        interval_min (int): Minutos hasta la próxima ejecución.
+
+    Returns:
+        None
+    """
+    cur.execute(
+        """
+        INSERT INTO spotify_ingestion_runs (fetched, new_rows, play_rate, next_interval_min)
+        VALUES (%s, %s, %s, %s)
+        """,
+        (fetched, new_rows, play_rate, interval_min)
+    )
+
+
+def record_gap(cur, gap_start, gap_end, recovered, filled):
+    """
+    Registra un hueco probable en el historial.
+
+    Args:
+        cur (cursor): Cursor de psycopg2.
+        gap_start (datetime): Última reproducción guardada antes del hueco.
+        gap_end (datetime): Reproducción más antigua de la lectura actual.
+        recovered (int): Reproducciones recuperadas paginando con `before`.
+        filled (bool): True si la paginación llegó hasta gap_start.
+
+    Returns:
+        None
+    """
+    cur.execute(
+        """
+        INSERT INTO spotify_history_gaps (gap_start, gap_end, recovered, filled)
+        VALUES (%s, %s, %s, %s)
+        """,
+        (gap_start, gap_end, recovered, filled)
+    )
+
+
+# ---------------------- Relleno de huecos ----------------------
+
+def parse_played_at(value):
+    """Convierte el played_at de la API ('2024-01-01T12:00:00.123Z') en datetime con zona horaria."""
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def fill_gap(sp, oldest, last_stored, max_pages=10):
+    """
+    Pagina hacia atrás con `before` para recuperar reproducciones entre la última
+    guardada y la más antigua de la lectura actual.
+
+    Args:
+        sp (Spotify): Cliente de spotipy autenticado.
+        oldest (datetime): Reproducción más antigua de la lectura actual.
+        last_stored (datetime): Última reproducción guardada en la base de datos.
+        max_pages (int, optional): Páginas máximas a pedir. Por defecto, 10.
+
+    Returns:
+        tuple: (lista de items recuperados, True si se alcanzó last_stored).
+    """
+    recovered = []
+    before = oldest
+    for _ in range(max_pages):
+        page = sp.current_user_recently_played(
+            limit=WINDOW, before=int(before.timestamp() * 1000)
+        ).get("items", [])
+        if not page:
+            return recovered, False
+        for item in page:
+            if parse_played_at(item["played_at"]) <= last_stored:
+                return recovered, True
+            recovered.append(item)
+        before = min(parse_played_at(item["played_at"]) for item in page)
+    return recovered, False
@@ -0,0 +1,281 @@
+import argparse
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# ---------------------- Constantes ----------------------
+
+# Estados de una fila en el spool
+PENDING, FLUSHED, FAILED = 0, 1, -1
+
+# Errores de conexión: se reintentan. Los errores de datos se aíslan fila a fila
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+DATA_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+COLUMNS = [
+    "played_at",
+    "track_name",
+    "duration_ms",
+    "track_id",
+    "artist_name",
+    "artist_id",
+    "artist_genres",
+    "artist_img",
+    "album_name",
+    "album_id",
+    "album_release_year",
+    "album_label",
+    "album_img",
+]
+
+BATCH_SIZE = 500
+
+# Las filas ya volcadas se conservan unos días para deduplicar sin base de datos
+KEEP_FLUSHED_DAYS = 7
+
+INSERT_SQL = f"""
+INSERT INTO spotify_recently_played ({", ".join(COLUMNS)})
+VALUES %s
+ON CONFLICT (played_at) DO NOTHING;
+"""
+
+
+# ---------------------- Spool local (SQLite) ----------------------
+
+def _now():
+    # Ancho fijo (siempre con microsegundos) para que min() sobre el texto ordene bien
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def open_spool(path):
+    """
+    Abre (o crea) el spool local donde se guardan las filas enriquecidas antes de
+    enviarlas a Postgres.
+
+    Args:
+        path (str): Ruta del fichero SQLite.
+
+    Returns:
+        sqlite3.Connection: Conexión al spool.
+    """
+    spool = sqlite3.connect(path)
+    spool.execute("PRAGMA synchronous=FULL")
+    spool.execute("""
+        CREATE TABLE IF NOT EXISTS spool (
+            played_at TEXT PRIMARY KEY,
+            payload   TEXT NOT NULL,
+            flushed   INTEGER NOT NULL DEFAULT 0,
+            error     TEXT,
+            spooled_at TEXT
+        )
+    """)
+    # Spools creados antes de existir las columnas error y spooled_at
+    columns = {row[1] for row in spool.execute("PRAGMA table_info(spool)")}
+    if "error" not in columns:
+        spool.execute("ALTER TABLE spool ADD COLUMN error TEXT")
+    if "spooled_at" not in columns:
+        spool.execute("ALTER TABLE spool ADD COLUMN spooled_at TEXT")
+        spool.execute("UPDATE spool SET spooled_at = ?", (_now(),))
+    spool.commit()
+    return spool
+
+
+def append_rows(spool, rows):
+    """
+    Añade filas enriquecidas al spool. Las reproducciones ya presentes se ignoran.
+
+    Args:
+        spool (sqlite3.Connection): Conexión al spool.
+        rows (list): Filas con las claves de COLUMNS.
+
+    Returns:
+        int: Número de filas nuevas en el spool.
+    """
+    with spool:
+        cur = spool.executemany(
+            "INSERT OR IGNORE INTO spool (played_at, payload, spooled_at) VALUES (?, ?, ?)",
+            [(row["played_at"], json.dumps(row), _now()) for row in rows]
+        )
+    return cur.rowcount
+
+
+def spooled_played_at(spool):
+    """
+    Devuelve los played_at presentes en el spool (volcados, pendientes o rechazados).
+
+    Las filas rechazadas cuentan como existentes para no volver a enriquecerlas en
+    cada ejecución; se reintentan con requeue_failed.
+
+    Args:
+        spool (sqlite3.Connection): Conexión al spool.
+
+    Returns:
+        set: played_at en el formato de la API.
+    """
+    return {row[0] for row in spool.execute("SELECT played_at FROM spool")}
+
+
+def pending_count(spool):
+    """
+    Cuenta las filas pendientes de volcar a Postgres.
+
+    Args:
+        spool (sqlite3.Connection): Conexión al spool.
+
+    Returns:
+        int: Número de filas pendientes.
+    """
+    return spool.execute("SELECT count(*) FROM spool WHERE flushed = ?", (PENDING,)).fetchone()[0]
+
+
+def oldest_pending(spool):
+    """
+    Devuelve cuándo entró en el spool la fila pendiente más antigua.
+
+    Se usa spooled_at y no played_at: una reproducción de hace días recién
+    guardada no lleva días esperando a Postgres.
+
+    Args:
+        spool (sqlite3.Connection): Conexión al spool.
+
+    Returns:
+        datetime | None: spooled_at más antiguo pendiente, o None si no hay pendientes.
+    """
+    oldest = spool.execute(
+        "SELECT min(spooled_at) FROM spool WHERE flushed = ?", (PENDING,)
+    ).fetchone()[0]
+    return datetime.fromisoformat(oldest.replace("Z", "+00:00")) if oldest else None
+
+
+def requeue_failed(spool):
+    """
+    Devuelve a pendientes las filas rechazadas por Postgres (p. ej. tras corregir el esquema).
+
+    Args:
+        spool (sqlite3.Connection): Conexión al spool.
+
+    Returns:
+        int: Número de filas reencoladas.
+    """
+    with spool:
+        cur = spool.execute(
+            "UPDATE spool SET flushed = ?, error = NULL, spooled_at = ? WHERE flushed = ?",
+            (PENDING, _now(), FAILED)
+        )
+    return cur.rowcount
+
+
+def _mark(spool, played_ats, state, error=None):
+    with spool:
+        spool.executemany(
+            "UPDATE spool SET flushed = ?, error = ? WHERE played_at = ?",
+            [(state, error, played_at) for played_at in played_ats]
+        )
+
+
+def _rollback(conn):
+    # Con la conexión rota, el rollback también falla: el error original es el relevante
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        pass
+
+
+def _insert(conn, values, page_size):
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, INSERT_SQL, values, page_size=page_size)
+        conn.commit()
+    except psycopg2.Error:
+        _rollback(conn)
+        raise
+
+
+def flush_to_postgres(spool, conn, batch_size=BATCH_SIZE):
+    """
+    Vuelca las filas pendientes del spool a Postgres por lotes.
+
+    Cada lote se confirma en Postgres antes de marcarse como volcado en el spool.
+    Si el proceso se corta entre ambos pasos, el lote se reenvía en la siguiente
+    ejecución y ON CONFLICT (played_at) lo hace idempotente.
+
+    Si un lote falla por un error de datos, se reintenta fila a fila y las filas
+    rechazadas se marcan como FAILED (con el error) para no bloquear las siguientes.
+    Los errores de conexión se propagan para que el llamador reconecte.
+
+    Args:
+        spool (sqlite3.Connection): Conexión al spool.
+        conn (connection): Conexión de psycopg2 abierta.
+        batch_size (int, optional): Filas por lote. Por defecto, BATCH_SIZE.
+
+    Returns:
+        tuple: (filas volcadas, filas marcadas como FAILED).
+    """
+    flushed, failed = 0, 0
+    while True:
+        batch = spool.execute(
+            "SELECT played_at, payload FROM spool WHERE flushed = ? ORDER BY played_at LIMIT ?",
+            (PENDING, batch_size)
+        ).fetchall()
+        if not batch:
+            break
+
+        values = {}
+        for played_at, payload in batch:
+            row = json.loads(payload)
+            values[played_at] = tuple(row[col] for col in COLUMNS)
+
+        try:
+            _insert(conn, list(values.values()), batch_size)
+        except DATA_ERRORS:
+            for played_at, value in values.items():
+                try:
+                    _insert(conn, [value], 1)
+                except DATA_ERRORS as e:
+                    _mark(spool, [played_at], FAILED, str(e).strip())
+                    failed += 1
+                else:
+                    _mark(spool, [played_at], FLUSHED)
+                    flushed += 1
+            continue
+
+        _mark(spool, values.keys(), FLUSHED)
+        flushed += len(batch)
+
+    return flushed, failed
+
+
+def prune_flushed(spool, keep_days=KEEP_FLUSHED_DAYS):
+    """
+    Elimina del spool las filas ya volcadas con más de keep_days días.
+
+    Args:
+        spool (sqlite3.Connection): Conexión al spool.
+        keep_days (int, optional): Días a conservar. Por defecto, KEEP_FLUSHED_DAYS.
+
+    Returns:
+        None
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=keep_days)).strftime("%Y-%m-%dT%H:%M:%S")
+    with spool:
+        spool.execute("DELETE FROM spool WHERE flushed = ? AND played_at < ?", (FLUSHED, cutoff))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspecciona o reencola el spool local")
+    parser.add_argument("path", nargs="?", default="spool.sqlite3")
+    parser.add_argument("--requeue", action="store_true", help="Vuelve a encolar las filas rechazadas")
+    args = parser.parse_args()
+
+    spool = open_spool(args.path)
+    if args.requeue:
+        print(f"Reencoladas {requeue_failed(spool)} filas rechazadas")
+    for played_at, error in spool.execute(
+        "SELECT played_at, error FROM spool WHERE flushed = ? ORDER BY played_at", (FAILED,)
+    ):
+        print(f"Rechazada {played_at}: {error}")
+    print(f"{pending_count(spool)} filas pendientes")
+    spool.close()
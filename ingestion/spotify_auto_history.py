@@ -1,33 +1,156 @@
 import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import psycopg2
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyOAuth
 
+from db import get_connection
+from scheduler import (
+    WINDOW,
+    ensure_tables,
+    estimate_play_rate,
+    fill_gap,
+    is_due,
+    next_interval,
+    parse_played_at,
+    record_gap,
+    record_run,
+)
+from spool import (
+    CONNECTION_ERRORS,
+    append_rows,
+    flush_to_postgres,
+    oldest_pending,
+    open_spool,
+    pending_count,
+    prune_flushed,
+    requeue_failed,
+    spooled_played_at,
+)
+
 # ---------------------- Configuración desde secrets de variables de entorno ----------------------
 CLIENT_ID = os.getenv("SPOTIPY_CLIENT_ID")
 CLIENT_SECRET = os.getenv("SPOTIPY_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("SPOTIPY_REDIRECT_URI")
 CACHE_CONTENT = os.getenv("SPOTIPY_CACHE")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Las ejecuciones manuales (workflow_dispatch) ignoran el intervalo adaptativo
+FORCE_RUN = os.getenv("FORCE_RUN", "").lower() == "true"
 
 # ---------------------- Constantes ----------------------
 
 DATA_PATH = "spotify_history.csv"
 CACHE_PATH = ".cache"
+# Páginas máximas hacia atrás al intentar rellenar un hueco
+MAX_GAP_PAGES = 10
+# Spool local que persiste las filas enriquecidas mientras Postgres no responde
+SPOOL_PATH = os.getenv("SPOOL_PATH", "spool.sqlite3")
+# Una base de datos lenta debe fallar rápido en lugar de colgar la ejecución
+DB_STATEMENT_TIMEOUT_MS = 15000
+FLUSH_RETRIES = 3
+# Si quedan pendientes en el spool desde hace más de esto, el workflow se marca como fallido
+MAX_PENDING_HOURS = 6
 
 # ---------------------- Conexión a la base de datos ----------------------
 
-conn = psycopg2.connect(
-    host="aws-1-eu-north-1.pooler.supabase.com",
-    dbname="postgres",
-    user="postgres.prwcramdanblevcpaghy",
-    password=os.getenv("DB_PASSWORD"),
-    port=5432,
-    sslmode="require"
-)
+def connect_db():
+    """Abre la conexión a Postgres; devuelve None si la base de datos no responde."""
+    try:
+        return get_connection(statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS)
+    except psycopg2.OperationalError as e:
+        print(f"Base de datos no disponible: {e}")
+        return None
+
+
+def db_step(conn, step):
+    """
+    Ejecuta un paso contra Postgres antes de que las filas lleguen al spool.
+
+    Si la base de datos falla (caída, reinicio del pooler, statement_timeout),
+    se descarta la conexión y la ejecución sigue solo con el spool.
+
+    Returns:
+        tuple: (conexión abierta o None, resultado del paso o None).
+    """
+    if conn is None:
+        return None, None
+    try:
+        with conn.cursor() as cur:
+            result = step(cur)
+        conn.commit()
+        return conn, result
+    except psycopg2.Error as e:
+        print(f"Base de datos no disponible, se sigue solo con el spool: {e}")
+        conn.close()
+        return None, None
+
+
+def flush_spool(spool, conn):
+    """
+    Vuelca el spool a Postgres, reconectando y reintentando si se pierde la conexión.
+
+    Los errores de datos no se reintentan: flush_to_postgres marca esas filas como
+    FAILED y sigue con el resto.
+
+    Returns:
+        tuple: (conexión abierta o None, filas volcadas, filas rechazadas).
+    """
+    for attempt in range(FLUSH_RETRIES):
+        if conn is None:
+            conn = connect_db()
+        if conn is not None:
+            try:
+                return (conn, *flush_to_postgres(spool, conn))
+            except CONNECTION_ERRORS as e:
+                print(f"Error volcando el spool (intento {attempt + 1}/{FLUSH_RETRIES}): {e}")
+                conn.close()
+                conn = None
+        if attempt < FLUSH_RETRIES - 1:
+            time.sleep(2 ** attempt)
+    return conn, 0, 0
+
+
+def spool_exit_code(spool, failed):
+    """Devuelve 1 si hay filas rechazadas en esta ejecución o pendientes desde hace demasiado."""
+    code = 0
+    if failed:
+        print(f"{failed} reproducciones rechazadas por Postgres (flushed = -1 en el spool; "
+              "se reintentan lanzando el workflow a mano)")
+        code = 1
+    oldest = oldest_pending(spool)
+    if oldest and oldest < datetime.now(timezone.utc) - timedelta(hours=MAX_PENDING_HOURS):
+        print(f"{pending_count(spool)} reproducciones pendientes en el spool desde {oldest}")
+        code = 1
+    return code
+
+
+spool = open_spool(SPOOL_PATH)
+
+# En GitHub Actions el spool solo vive en la caché: una ejecución manual
+# (workflow_dispatch) es la forma de reintentar las filas rechazadas
+if FORCE_RUN:
+    requeued = requeue_failed(spool)
+    if requeued:
+        print(f"Reencoladas {requeued} reproducciones rechazadas")
+
+conn = connect_db()
+conn, _ = db_step(conn, ensure_tables)
 
-cur = conn.cursor()
+# ---------------------- ¿Toca ejecutar? ----------------------
+# Sin base de datos no se conoce el intervalo: se lee siempre para no perder reproducciones
+if conn is not None and not FORCE_RUN:
+    conn, due = db_step(conn, is_due)
+    if due is False:
+        conn, flushed, failed = flush_spool(spool, conn)
+        if conn is not None:
+            conn.close()
+        code = spool_exit_code(spool, failed)
+        spool.close()
+        print(f"Aún no toca ejecutar según el intervalo adaptativo ({flushed} filas del spool volcadas)")
+        sys.exit(code)
 
 # ---------------------- Crear archivo .cache si no existe ----------------------
 if CACHE_CONTENT and not os.path.exists(CACHE_PATH):
@@ -47,10 +170,57 @@ sp = Spotify(
 )
 
 # ---------------------- Obtener últimas 50 reproducciones ----------------------
-data = sp.current_user_recently_played(limit=50)
+data = sp.current_user_recently_played(limit=WINDOW)
 items = data.get("items", [])
+fetched = len(items)
+
+# ---------------------- Filtrar las ya guardadas ----------------------
+# El spool conserva las reproducciones de los últimos días, así que se puede
+# deduplicar aunque la base de datos no responda
+existing = {parse_played_at(played_at) for played_at in spooled_played_at(spool)}
+last_stored = max(existing) if existing else None
+
+if items:
+    oldest = min(parse_played_at(item["played_at"]) for item in items)
+
+
+def load_stored(cur):
+    cur.execute("SELECT max(played_at) FROM spotify_recently_played")
+    db_last = cur.fetchone()[0]
+    db_existing = set()
+    if items:
+        cur.execute(
+            "SELECT played_at FROM spotify_recently_played WHERE played_at >= %s",
+            (oldest,)
+        )
+        db_existing = {row[0] for row in cur.fetchall()}
+    return db_last, db_existing
+
+
+conn, stored = db_step(conn, load_stored)
+if stored is not None:
+    db_last, db_existing = stored
+    existing |= db_existing
+    if db_last is not None:
+        last_stored = max(last_stored, db_last) if last_stored else db_last
+
+items = [item for item in items if parse_played_at(item["played_at"]) not in existing]
+
+# ---------------------- Detectar y rellenar huecos ----------------------
+# 50 reproducciones todas nuevas: probablemente se han perdido algunas entre medias
+if fetched == WINDOW and len(items) == WINDOW and last_stored is not None:
+    recovered, filled = fill_gap(sp, oldest, last_stored, MAX_GAP_PAGES)
+    items.extend(recovered)
+    print(f"Hueco detectado entre {last_stored} y {oldest}: {len(recovered)} recuperadas, rellenado={filled}")
+    # Sin base de datos el hueco se rellena igualmente, pero no se registra
+    conn, _ = db_step(
+        conn, lambda cur: record_gap(cur, last_stored, oldest, len(recovered), filled)
+    )
 
 rows = []
+# Un mismo artista/álbum suele repetirse: se piden una sola vez por ejecución
+artists_cache = {}
+albums_cache = {}
 
 for item in items:
     track = item["track"]
@@ -58,8 +228,12 @@ for item in items:
     artist = track["artists"][0]
 
     # --------- Llamadas completas ---------
-    artist_full = sp.artist(artist["id"])
-    album_full = sp.album(album["id"])   # ← NECESARIO para label
+    if artist["id"] not in artists_cache:
+        artists_cache[artist["id"]] = sp.artist(artist["id"])
+    if album["id"] not in albums_cache:
+        albums_cache[album["id"]] = sp.album(album["id"])   # ← NECESARIO para label
+    artist_full = artists_cache[artist["id"]]
+    album_full = albums_cache[album["id"]]
 
     # --------- Imágenes 300x300 ---------
     artist_images = artist_full.get("images", [])
@@ -100,49 +274,36 @@ for item in items:
         }
     )
 
-# ---------------------- Insert en Postgres ----------------------
-insert_sql = """
-INSERT INTO spotify_recently_played (
-    played_at,
-    track_name,
-    duration_ms,
-    track_id,
-    artist_name,
-    artist_id,
-    artist_genres,
-    artist_img,
-    album_name,
-    album_id,
-    album_release_year,
-    album_label,
-    album_img
-)
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-ON CONFLICT (played_at) DO NOTHING;
-"""
-
-for row in rows:
-    cur.execute(
-        insert_sql,
-        (
-            row["played_at"],
-            row["track_name"],
-            row["duration_ms"],
-            row["track_id"],
-            row["artist_name"],
-            row["artist_id"],
-            row["artist_genres"],
-            row["artist_img"],
-            row["album_name"],
-            row["album_id"],
-            row["album_release_year"],
-            row["album_label"],
-            row["album_img"],
-        )
-    )
+# ---------------------- Guardar en el spool local ----------------------
+# Primero se persisten en disco: si Postgres falla, se vuelcan en la siguiente ejecución
+spooled = append_rows(spool, rows)
+print(f"Guardadas {spooled} reproducciones en el spool")
+
+# ---------------------- Volcado a Postgres ----------------------
+conn, flushed, failed = flush_spool(spool, conn)
+prune_flushed(spool)
+code = spool_exit_code(spool, failed)
+
+if conn is None:
+    print(f"Postgres no disponible: {pending_count(spool)} reproducciones pendientes en el spool")
+    spool.close()
+    sys.exit(code)
+
+# ---------------------- Programar la próxima ejecución ----------------------
+def schedule_next(cur):
+    play_rate = estimate_play_rate(cur)
+    interval_min = next_interval(play_rate)
+    record_run(cur, fetched, len(rows), play_rate, interval_min)
+    return play_rate, interval_min
+
 
-conn.commit()
-cur.close()
-conn.close()
+conn, scheduled = db_step(conn, schedule_next)
+if conn is not None:
+    conn.close()
+spool.close()
 
-print(f"Insertadas {len(rows)} reproducciones (sin duplicados)")
+print(f"Insertadas {flushed} reproducciones (sin duplicados)")
+if scheduled is not None:
+    play_rate, interval_min = scheduled
+    print(f"Ritmo estimado: {play_rate:.2f} reproducciones/min, próxima ejecución en {interval_min} min")
+sys.exit(code)
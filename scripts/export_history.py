@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pandas as pd
+
+# db.py vive en ingestion/ y lo comparten el job y los scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ingestion"))
+from db import get_connection
+
+# ---------------------- Constantes ----------------------
+
+TABLE = "spotify_recently_played"
+CHUNK_SIZE = 5000
+
+COLUMNS = [
+    "played_at",
+    "track_name",
+    "duration_ms",
+    "track_id",
+    "artist_name",
+    "artist_id",
+    "artist_genres",
+    "artist_img",
+    "album_name",
+    "album_id",
+    "album_release_year",
+    "album_label",
+    "album_img",
+]
+
+
+# ---------------------- Estado de la última exportación ----------------------
+
+def state_path_for(output):
+    """
+    Devuelve la ruta del fichero de estado asociado a una exportación.
+
+    Args:
+        output (str): Ruta del CSV o del directorio Parquet de salida.
+
+    Returns:
+        str: Ruta del fichero JSON donde se guarda el último played_at exportado.
+    """
+    return f"{output.rstrip(os.sep)}.state.json"
+
+
+def load_last_exported(state_path):
+    """
+    Lee el último played_at exportado, si existe.
+
+    Args:
+        state_path (str): Ruta del fichero de estado.
+
+    Returns:
+        str | None: Timestamp ISO de la última reproducción exportada o None.
+    """
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, "r", encoding="UTF-8") as f:
+        return json.load(f).get("last_played_at")
+
+
+def save_last_exported(state_path, last_played_at):
+    """
+    Guarda el último played_at exportado de forma atómica.
+
+    Args:
+        state_path (str): Ruta del fichero de estado.
+        last_played_at (str): Timestamp ISO de la última reproducción exportada.
+
+    Returns:
+        None
+    """
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="UTF-8") as f:
+        json.dump({"last_played_at": last_played_at}, f)
+    os.replace(tmp_path, state_path)
+
+
+# ---------------------- Lectura en streaming ----------------------
+
+def iter_chunks(conn, start=None, end=None, after=None, chunk_size=CHUNK_SIZE):
+    """
+    Recorre la tabla en bloques usando un cursor con nombre (server-side), de modo
+    que psycopg2 nunca carga el resultado completo en memoria.
+
+    Args:
+        conn (connection): Conexión de psycopg2 abierta.
+        start (str, optional): Incluye reproducciones con played_at >= start.
+        end (str, optional): Incluye reproducciones con played_at < end.
+        after (str, optional): Incluye reproducciones con played_at > after (modo incremental).
+        chunk_size (int, optional): Filas por bloque. Por defecto, CHUNK_SIZE.
+
+    Yields:
+        DataFrame: Bloque de como máximo chunk_size filas ordenadas por played_at.
+    """
+    conditions = []
+    params = []
+    if start:
+        conditions.append("played_at >= %s")
+        params.append(start)
+    if end:
+        conditions.append("played_at < %s")
+        params.append(end)
+    if after:
+        conditions.append("played_at > %s")
+        params.append(after)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT {', '.join(COLUMNS)} FROM {TABLE} {where} ORDER BY played_at"
+
+    with conn.cursor(name="spotify_export") as cur:
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            df = pd.DataFrame(rows, columns=COLUMNS)
+            df["played_at"] = pd.to_datetime(df["played_at"], utc=True)
+            yield df
+
+
+# ---------------------- Escritura incremental ----------------------
+
+def _write_csv(chunks, output, append, state_path):
+    # Se reescribe la salida (solo cabecera) antes de leer nada, para que una
+    # exportación completa sin filas no deje el CSV anterior intacto
+    if not append or not os.path.exists(output) or os.path.getsize(output) == 0:
+        pd.DataFrame(columns=COLUMNS).to_csv(output, index=False)
+    total = 0
+
+    for df in chunks:
+        # Mismo formato que spotify_history.csv ("genre1, genre2")
+        df["artist_genres"] = df["artist_genres"].map(
+            lambda genres: ", ".join(genres) if genres else None
+        )
+        df.to_csv(output, mode="a", header=False, index=False)
+        total += len(df)
+
+        # Cada bloque queda escrito en disco: se puede reanudar desde aquí
+        save_last_exported(state_path, df["played_at"].iloc[-1].isoformat())
+
+    return total
+
+
+def _write_parquet(chunks, output, append, state_path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("La exportación a Parquet necesita pyarrow (pip install pyarrow)") from e
+
+    schema = pa.schema([
+        ("played_at", pa.timestamp("us", tz="UTC")),
+        ("track_name", pa.string()),
+        ("duration_ms", pa.int64()),
+        ("track_id", pa.string()),
+        ("artist_name", pa.string()),
+        ("artist_id", pa.string()),
+        ("artist_genres", pa.list_(pa.string())),
+        ("artist_img", pa.string()),
+        ("album_name", pa.string()),
+        ("album_id", pa.string()),
+        ("album_release_year", pa.string()),
+        ("album_label", pa.string()),
+        ("album_img", pa.string()),
+    ])
+
+    # Parquet no admite añadir filas a un fichero cerrado: la salida es un
+    # directorio y cada ejecución escribe un nuevo fichero part-*.parquet
+    os.makedirs(output, exist_ok=True)
+    if not append:
+        for name in os.listdir(output):
+            if name.startswith("part-") and name.endswith(".parquet"):
+                os.remove(os.path.join(output, name))
+
+    # El uuid evita que dos ejecuciones en el mismo segundo se pisen el fichero
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    part_path = os.path.join(output, f"part-{stamp}-{uuid4().hex[:8]}.parquet")
+    tmp_path = f"{part_path}.tmp"
+
+    writer = None
+    last_played_at = None
+    total = 0
+    try:
+        for df in chunks:
+            df["album_release_year"] = df["album_release_year"].map(
+                lambda year: None if year is None else str(year)
+            )
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(table)
+            last_played_at = df["played_at"].iloc[-1].isoformat()
+            total += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    # El fichero solo es válido una vez escrito el footer
+    if writer is not None:
+        os.replace(tmp_path, part_path)
+        save_last_exported(state_path, last_played_at)
+
+    return total
+
+
+def export_history(output, fmt="csv", start=None, end=None, incremental=False, chunk_size=CHUNK_SIZE, conn=None):
+    """
+    Exporta spotify_recently_played a CSV o Parquet en streaming, con memoria acotada.
+
+    Args:
+        output (str): Ruta del CSV o directorio Parquet de salida.
+        fmt (str, optional): 'csv' o 'parquet'. Por defecto, 'csv'.
+        start (str, optional): Límite inferior (inclusive) de played_at.
+        end (str, optional): Límite superior (exclusivo) de played_at.
+        incremental (bool, optional): Si es True, solo exporta las reproducciones
+            posteriores a la última exportación y las añade a la salida existente.
+            Si no hay estado previo, hace una exportación completa.
+        chunk_size (int, optional): Filas por bloque. Por defecto, CHUNK_SIZE.
+        conn (connection, optional): Conexión a reutilizar. Si no se indica, se abre una nueva.
+
+    Returns:
+        int: Número de reproducciones exportadas.
+    """
+    if fmt not in ("csv", "parquet"):
+        raise ValueError(f"Formato no soportado: {fmt}")
+
+    state_path = state_path_for(output)
+    after = load_last_exported(state_path) if incremental else None
+
+    # Sin marca de agua no se sabe qué hay ya en la salida: añadir una exportación
+    # sin límite duplicaría todo el historial, así que se reescribe desde cero
+    if incremental and after is None:
+        print(f"No existe {state_path}: se hace una exportación completa")
+        incremental = False
+
+    # Una exportación completa reemplaza la salida: la marca de agua anterior deja
+    # de corresponder con lo que hay en disco aunque no se exporte ninguna fila
+    if not incremental and os.path.exists(state_path):
+        os.remove(state_path)
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+
+    try:
+        chunks = iter_chunks(conn, start=start, end=end, after=after, chunk_size=chunk_size)
+        if fmt == "csv":
+            return _write_csv(chunks, output, incremental, state_path)
+        return _write_parquet(chunks, output, incremental, state_path)
+    finally:
+        if own_conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta el historial de Spotify desde Supabase")
+    parser.add_argument("output", help="Ruta del CSV o directorio Parquet de salida")
+    parser.add_argument("--format", dest="fmt", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--start", help="played_at mínimo (inclusive), p. ej. 2024-01-01")
+    parser.add_argument("--end", help="played_at máximo (exclusivo), p. ej. 2025-01-01")
+    parser.add_argument("--incremental", action="store_true", help="Exporta solo lo nuevo desde la última ejecución")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    n = export_history(
+        args.output,
+        fmt=args.fmt,
+        start=args.start,
+        end=args.end,
+        incremental=args.incremental,
+        chunk_size=args.chunk_size,
+    )
+    print(f"Exportadas {n} reproducciones a {args.output}")
@@ -0,0 +1,206 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, NamedTuple, Optional
+from uuid import uuid4
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+# Los índices que usan estas consultas se crean con scripts/migrate_indexes.py
+#
+# Todas las consultas son de solo lectura. Si la conexión no tenía una transacción
+# abierta, la que abre psycopg2 se cierra al terminar (o al dejar de iterar), para
+# no dejar la conexión "idle in transaction" en el pooler. Si el llamador ya tenía
+# una transacción en curso, se respeta y es él quien debe hacer commit o rollback.
+
+# ---------------------- Constantes ----------------------
+
+TABLE = "spotify_recently_played"
+CHUNK_SIZE = 2000
+
+PLAY_COLUMNS = [
+    "played_at",
+    "track_name",
+    "duration_ms",
+    "track_id",
+    "artist_name",
+    "artist_id",
+    "artist_genres",
+    "album_name",
+    "album_id",
+]
+
+
+# ---------------------- Tipos de resultado ----------------------
+
+class Play(NamedTuple):
+    played_at: datetime
+    track_name: str
+    duration_ms: int
+    track_id: str
+    artist_name: str
+    artist_id: str
+    artist_genres: Optional[List[str]]
+    album_name: Optional[str]
+    album_id: Optional[str]
+
+
+class TopEntry(NamedTuple):
+    id: str
+    name: str
+    plays: int
+    ms_played: int
+
+
+class TrackListens(NamedTuple):
+    track_id: str
+    track_name: str
+    first_played_at: datetime
+    last_played_at: datetime
+    plays: int
+
+
+# ---------------------- Utilidades ----------------------
+
+@contextmanager
+def _read_transaction(conn):
+    owns_transaction = conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+    try:
+        yield
+    finally:
+        if owns_transaction:
+            conn.rollback()
+
+
+def _stream(conn, sql, params, chunk_size=CHUNK_SIZE) -> Iterator[Play]:
+    # Cursor con nombre (server-side): las filas llegan por bloques según se consumen
+    with _read_transaction(conn):
+        with conn.cursor(name=f"spotify_query_{uuid4().hex}") as cur:
+            cur.itersize = chunk_size
+            cur.execute(sql, params)
+            for row in cur:
+                yield Play(*row)
+
+
+def _time_filter(start, end, conditions, params):
+    if start is not None:
+        conditions.append("played_at >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("played_at < %s")
+        params.append(end)
+
+
+def _where(conditions):
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+# ---------------------- Consultas ----------------------
+
+def plays_between(conn, start: datetime, end: datetime) -> Iterator[Play]:
+    """
+    Devuelve en streaming las reproducciones de un rango de tiempo, ordenadas por played_at.
+
+    Args:
+        conn (connection): Conexión de psycopg2 abierta.
+        start (datetime): Inicio del rango (inclusive).
+        end (datetime): Fin del rango (exclusivo).
+
+    Yields:
+        Play: Una reproducción por fila.
+    """
+    conditions, params = [], []
+    _time_filter(start, end, conditions, params)
+    sql = f"SELECT {', '.join(PLAY_COLUMNS)} FROM {TABLE} {_where(conditions)} ORDER BY played_at"
+    return _stream(conn, sql, params)
+
+
+def plays_by_genre(conn, genre: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[Play]:
+    """
+    Devuelve en streaming las reproducciones de artistas de un género.
+
+    Args:
+        conn (connection): Conexión de psycopg2 abierta.
+        genre (str): Género exacto tal y como lo guarda Spotify (p. ej. 'indie rock').
+        start (datetime, optional): Inicio del rango (inclusive).
+        end (datetime, optional): Fin del rango (exclusivo).
+
+    Yields:
+        Play: Una reproducción por fila, ordenadas por played_at.
+    """
+    # @> usa el índice GIN sobre artist_genres
+    conditions, params = ["artist_genres @> ARRAY[%s]::text[]"], [genre]
+    _time_filter(start, end, conditions, params)
+    sql = f"SELECT {', '.join(PLAY_COLUMNS)} FROM {TABLE} {_where(conditions)} ORDER BY played_at"
+    return _stream(conn, sql, params)
+
+
+def _top(conn, id_col, name_col, start, end, limit) -> List[TopEntry]:
+    conditions, params = [], []
+    _time_filter(start, end, conditions, params)
+    sql = f"""
+        SELECT {id_col}, max({name_col}), count(*), coalesce(sum(duration_ms), 0)
+        FROM {TABLE}
+        {_where(conditions)}
+        GROUP BY {id_col}
+        ORDER BY count(*) DESC, coalesce(sum(duration_ms), 0) DESC
+        LIMIT %s
+    """
+    with _read_transaction(conn), conn.cursor() as cur:
+        cur.execute(sql, params + [limit])
+        return [TopEntry(*row) for row in cur.fetchall()]
+
+
+def top_artists(conn, start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = 10) -> List[TopEntry]:
+    """
+    Calcula los artistas más escuchados en un rango de tiempo.
+
+    Args:
+        conn (connection): Conexión de psycopg2 abierta.
+        start (datetime, optional): Inicio del rango (inclusive).
+        end (datetime, optional): Fin del rango (exclusivo).
+        limit (int, optional): Número de artistas a devolver. Por defecto, 10.
+
+    Returns:
+        list: TopEntry ordenados por número de reproducciones.
+    """
+    return _top(conn, "artist_id", "artist_name", start, end, limit)
+
+
+def top_tracks(conn, start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = 10) -> List[TopEntry]:
+    """
+    Calcula las canciones más escuchadas en un rango de tiempo.
+
+    Args:
+        conn (connection): Conexión de psycopg2 abierta.
+        start (datetime, optional): Inicio del rango (inclusive).
+        end (datetime, optional): Fin del rango (exclusivo).
+        limit (int, optional): Número de canciones a devolver. Por defecto, 10.
+
+    Returns:
+        list: TopEntry ordenados por número de reproducciones.
+    """
+    return _top(conn, "track_id", "track_name", start, end, limit)
+
+
+def track_listens(conn, track_id: str) -> Optional[TrackListens]:
+    """
+    Devuelve la primera y la última escucha de una canción.
+
+    Args:
+        conn (connection): Conexión de psycopg2 abierta.
+        track_id (str): Identificador de Spotify de la canción.
+
+    Returns:
+        TrackListens | None: Primera y última escucha y total de reproducciones,
+            o None si la canción no está en el historial.
+    """
+    sql = f"""
+        SELECT track_id, max(track_name), min(played_at), max(played_at), count(*)
+        FROM {TABLE}
+        WHERE track_id = %s
+        GROUP BY track_id
+    """
+    with _read_transaction(conn), conn.cursor() as cur:
+        cur.execute(sql, (track_id,))
+        row = cur.fetchone()
+    return TrackListens(*row) if row else None
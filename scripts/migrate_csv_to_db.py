@@ -1,18 +1,15 @@
 import pandas as pd
-import psycopg2
 import os
+import sys
+
+# db.py vive en ingestion/ y lo comparten el job y los scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ingestion"))
+from db import get_connection
 
 # ---------------------- Configuración desde secrets de variables de entorno ----------------------
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-conn = psycopg2.connect(
-    host="aws-1-eu-north-1.pooler.supabase.com",
-    dbname="postgres",
-    user="postgres.prwcramdanblevcpaghy",
-    password=os.getenv("DB_PASSWORD"),
-    port=5432,
-    sslmode="require"
-)
+conn = get_connection()
 
 cur = conn.cursor()
 
@@ -0,0 +1,71 @@
+import os
+import sys
+
+# db.py vive en ingestion/ y lo comparten el job y los scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ingestion"))
+from db import get_connection
+
+# ---------------------- Índices para history_queries.py ----------------------
+# CONCURRENTLY evita bloquear los INSERT del job mientras se construyen
+
+INDEXES = {
+    # Rangos de tiempo. El índice único (B-tree) sobre played_at ya resuelve los
+    # rangos, pero BRIN ocupa unos pocos KB frente a un B-tree del tamaño de la
+    # tabla y, como played_at crece con cada inserción, el planner lo prefiere
+    # para rangos amplios (meses, años) en los que recorrer el B-tree cuesta más
+    # que leer los bloques contiguos que indica BRIN
+    "spotify_recently_played_played_at_brin": """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS spotify_recently_played_played_at_brin
+        ON spotify_recently_played USING brin (played_at);
+    """,
+    # Búsquedas por género (artist_genres @> ARRAY['...'])
+    "spotify_recently_played_artist_genres_gin": """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS spotify_recently_played_artist_genres_gin
+        ON spotify_recently_played USING gin (artist_genres);
+    """,
+    "spotify_recently_played_artist_id_idx": """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS spotify_recently_played_artist_id_idx
+        ON spotify_recently_played (artist_id);
+    """,
+    # Primera/última escucha de una canción sin recorrer la tabla
+    "spotify_recently_played_track_id_idx": """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS spotify_recently_played_track_id_idx
+        ON spotify_recently_played (track_id, played_at);
+    """,
+}
+
+# Un CREATE INDEX CONCURRENTLY que falla deja el índice marcado como INVALID, y
+# IF NOT EXISTS lo saltaría en silencio: hay que borrarlo y volver a crearlo
+invalid_sql = """
+SELECT c.relname
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+WHERE c.relname = ANY(%s) AND NOT i.indisvalid;
+"""
+
+conn = get_connection()
+# CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+conn.autocommit = True
+
+cur = conn.cursor()
+
+cur.execute(invalid_sql, (list(INDEXES),))
+for (name,) in cur.fetchall():
+    print(f"Índice inválido, se vuelve a crear: {name}")
+    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+
+for sql in INDEXES.values():
+    cur.execute(sql)
+
+cur.execute(invalid_sql, (list(INDEXES),))
+invalid = [name for (name,) in cur.fetchall()]
+
+cur.execute("ANALYZE spotify_recently_played;")
+
+cur.close()
+conn.close()
+
+if invalid:
+    sys.exit(f"Índices inválidos tras la migración: {', '.join(invalid)}")
+
+print(f"Creados {len(INDEXES)} índices en spotify_recently_played")
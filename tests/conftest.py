@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Los scripts de ingestion/ y scripts/ se ejecutan como ficheros sueltos e
+# importan sus módulos hermanos directamente
+for folder in ("ingestion", "scripts"):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", folder))
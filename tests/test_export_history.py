@@ -0,0 +1,179 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("psycopg2")
+
+from export_history import (
+    COLUMNS,
+    export_history,
+    iter_chunks,
+    load_last_exported,
+    save_last_exported,
+    state_path_for,
+)
+
+T0 = datetime(2026, 10, 19, 10, 0, tzinfo=timezone.utc)
+
+
+class FakeNamedCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.queries.append((sql, list(params or [])))
+        self.pending = list(self.conn.rows)
+
+    def fetchmany(self, size):
+        chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
+
+class FakeConn:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+        self.cursor_names = []
+
+    def cursor(self, name=None):
+        self.cursor_names.append(name)
+        return FakeNamedCursor(self)
+
+
+def row(minutes, genres=("rock", "indie")):
+    values = {col: None for col in COLUMNS}
+    values.update(
+        played_at=T0 + timedelta(minutes=minutes),
+        track_name=f"track {minutes}",
+        duration_ms=180000,
+        track_id=f"t{minutes}",
+        artist_genres=list(genres) if genres else None,
+        album_release_year="2020",
+    )
+    return tuple(values[col] for col in COLUMNS)
+
+
+# ---------------------- Estado ----------------------
+
+def test_state_round_trip(tmp_path):
+    state_path = state_path_for(str(tmp_path / "out.csv"))
+    assert load_last_exported(state_path) is None
+    save_last_exported(state_path, "2026-10-19T10:00:00+00:00")
+    assert load_last_exported(state_path) == "2026-10-19T10:00:00+00:00"
+
+
+# ---------------------- iter_chunks ----------------------
+
+def test_iter_chunks_without_filters():
+    conn = FakeConn([row(0), row(1), row(2)])
+    chunks = list(iter_chunks(conn, chunk_size=2))
+
+    sql, params = conn.queries[0]
+    assert "WHERE" not in sql
+    assert sql.strip().endswith("ORDER BY played_at")
+    assert params == []
+    assert [len(df) for df in chunks] == [2, 1]
+    assert conn.cursor_names == ["spotify_export"]
+
+
+def test_iter_chunks_builds_where():
+    conn = FakeConn([])
+    list(iter_chunks(conn, start="2024-01-01", end="2025-01-01", after="2024-06-01"))
+
+    sql, params = conn.queries[0]
+    assert "WHERE played_at >= %s AND played_at < %s AND played_at > %s" in sql
+    assert params == ["2024-01-01", "2025-01-01", "2024-06-01"]
+
+
+# ---------------------- CSV ----------------------
+
+def test_csv_full_export(tmp_path):
+    output = str(tmp_path / "out.csv")
+    n = export_history(output, conn=FakeConn([row(0), row(1, genres=None)]), chunk_size=1)
+
+    df = pd.read_csv(output)
+    assert n == 2
+    assert list(df.columns) == COLUMNS
+    assert df["artist_genres"].tolist()[0] == "rock, indie"
+    assert pd.isna(df["artist_genres"].tolist()[1])
+    assert load_last_exported(state_path_for(output)) == (T0 + timedelta(minutes=1)).isoformat()
+
+
+def test_csv_incremental_appends_after_watermark(tmp_path):
+    output = str(tmp_path / "out.csv")
+    export_history(output, conn=FakeConn([row(0), row(1)]))
+
+    conn = FakeConn([row(2)])
+    n = export_history(output, incremental=True, conn=conn)
+
+    assert n == 1
+    assert conn.queries[0][1] == [(T0 + timedelta(minutes=1)).isoformat()]
+    df = pd.read_csv(output)
+    assert df["track_id"].tolist() == ["t0", "t1", "t2"]
+
+
+def test_csv_empty_full_export_truncates_and_resets_state(tmp_path):
+    output = str(tmp_path / "out.csv")
+    export_history(output, conn=FakeConn([row(0), row(1)]))
+
+    n = export_history(output, start="2030-01-01", conn=FakeConn([]))
+
+    assert n == 0
+    assert pd.read_csv(output).empty
+    assert list(pd.read_csv(output).columns) == COLUMNS
+    assert not os.path.exists(state_path_for(output))
+
+
+def test_csv_incremental_without_state_rewrites_output(tmp_path):
+    output = str(tmp_path / "out.csv")
+    export_history(output, conn=FakeConn([row(0), row(1)]))
+    os.remove(state_path_for(output))
+
+    conn = FakeConn([row(0), row(1)])
+    export_history(output, incremental=True, conn=conn)
+
+    assert conn.queries[0][1] == []
+    assert pd.read_csv(output)["track_id"].tolist() == ["t0", "t1"]
+
+
+# ---------------------- Parquet ----------------------
+
+def parquet_parts(output):
+    return sorted(name for name in os.listdir(output) if name.endswith(".parquet"))
+
+
+def test_parquet_incremental_runs_do_not_collide(tmp_path):
+    pytest.importorskip("pyarrow")
+    output = str(tmp_path / "out")
+    export_history(output, fmt="parquet", conn=FakeConn([row(0)]))
+    # Ejecuciones en el mismo segundo: el nombre del fichero no debe repetirse
+    export_history(output, fmt="parquet", incremental=True, conn=FakeConn([row(1)]))
+    export_history(output, fmt="parquet", incremental=True, conn=FakeConn([row(2)]))
+
+    assert len(parquet_parts(output)) == 3
+    df = pd.read_parquet(output)
+    assert sorted(df["track_id"]) == ["t0", "t1", "t2"]
+    assert list(df["artist_genres"].iloc[0]) == ["rock", "indie"]
+
+
+def test_parquet_incremental_without_state_replaces_parts(tmp_path):
+    pytest.importorskip("pyarrow")
+    output = str(tmp_path / "out")
+    export_history(output, fmt="parquet", conn=FakeConn([row(0), row(1)]))
+    os.remove(state_path_for(output))
+
+    export_history(output, fmt="parquet", incremental=True, conn=FakeConn([row(0), row(1)]))
+
+    assert len(parquet_parts(output)) == 1
+    assert sorted(pd.read_parquet(output)["track_id"]) == ["t0", "t1"]
+    with open(state_path_for(output)) as f:
+        assert json.load(f)["last_played_at"] == (T0 + timedelta(minutes=1)).isoformat()
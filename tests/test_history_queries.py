@@ -0,0 +1,164 @@
+from datetime import datetime, timezone
+
+import pytest
+
+extensions = pytest.importorskip("psycopg2.extensions")
+
+from history_queries import (
+    Play,
+    TopEntry,
+    TrackListens,
+    _time_filter,
+    _where,
+    plays_between,
+    plays_by_genre,
+    top_artists,
+    top_tracks,
+    track_listens,
+)
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+END = datetime(2026, 2, 1, tzinfo=timezone.utc)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.queries.append((sql, list(params)))
+        self.conn.status = extensions.TRANSACTION_STATUS_INTRANS
+
+    def __iter__(self):
+        return iter(self.conn.rows)
+
+    def fetchall(self):
+        return list(self.conn.rows)
+
+    def fetchone(self):
+        return self.conn.rows[0] if self.conn.rows else None
+
+
+class FakeConn:
+    def __init__(self, rows=(), status=None):
+        self.rows = list(rows)
+        self.queries = []
+        self.cursor_names = []
+        self.rollbacks = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE if status is None else status
+
+    def cursor(self, name=None):
+        self.cursor_names.append(name)
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+
+def play_row(minute=0):
+    played_at = datetime(2026, 1, 1, 10, minute, tzinfo=timezone.utc)
+    return (played_at, "song", 200000, "t1", "artist", "a1", ["rock"], "album", "al1")
+
+
+# ---------------------- Construcción del SQL ----------------------
+
+def test_time_filter_and_where():
+    conditions, params = [], []
+    _time_filter(START, END, conditions, params)
+    assert _where(conditions) == "WHERE played_at >= %s AND played_at < %s"
+    assert params == [START, END]
+
+
+def test_time_filter_open_ended():
+    conditions, params = [], []
+    _time_filter(None, None, conditions, params)
+    assert _where(conditions) == ""
+    assert params == []
+
+
+# ---------------------- Streaming ----------------------
+
+def test_plays_between_streams_plays():
+    conn = FakeConn([play_row(0), play_row(5)])
+
+    plays = list(plays_between(conn, START, END))
+
+    assert plays == [Play(*play_row(0)), Play(*play_row(5))]
+    assert plays[0].artist_genres == ["rock"]
+    assert conn.cursor_names[0].startswith("spotify_query_")
+    sql, params = conn.queries[0]
+    assert "WHERE played_at >= %s AND played_at < %s ORDER BY played_at" in sql
+    assert params == [START, END]
+
+
+def test_stream_ends_its_own_transaction():
+    conn = FakeConn([play_row(0), play_row(5)])
+    plays = plays_between(conn, START, END)
+
+    next(plays)
+    assert conn.rollbacks == 0
+    # Dejar de iterar a medias también cierra la transacción
+    plays.close()
+    assert conn.rollbacks == 1
+
+
+def test_stream_respects_caller_transaction():
+    conn = FakeConn([play_row(0)], status=extensions.TRANSACTION_STATUS_INTRANS)
+    list(plays_between(conn, START, END))
+    assert conn.rollbacks == 0
+
+
+def test_plays_by_genre_uses_array_containment():
+    conn = FakeConn([play_row(0)])
+    list(plays_by_genre(conn, "indie rock", start=START))
+
+    sql, params = conn.queries[0]
+    assert "WHERE artist_genres @> ARRAY[%s]::text[] AND played_at >= %s" in sql
+    assert params == ["indie rock", START]
+
+
+# ---------------------- Agregados ----------------------
+
+def test_top_artists_maps_rows():
+    conn = FakeConn([("a1", "artist", 12, 2400000), ("a2", "other", 3, 0)])
+
+    top = top_artists(conn, start=START, end=END, limit=2)
+
+    assert top == [TopEntry("a1", "artist", 12, 2400000), TopEntry("a2", "other", 3, 0)]
+    sql, params = conn.queries[0]
+    assert "GROUP BY artist_id" in sql
+    assert "ORDER BY count(*) DESC, coalesce(sum(duration_ms), 0) DESC" in sql
+    assert params == [START, END, 2]
+    assert conn.rollbacks == 1
+
+
+def test_top_tracks_groups_by_track():
+    conn = FakeConn([])
+    assert top_tracks(conn) == []
+    sql, params = conn.queries[0]
+    assert "GROUP BY track_id" in sql
+    assert "WHERE" not in sql
+    assert params == [10]
+
+
+def test_track_listens():
+    first = datetime(2025, 3, 1, tzinfo=timezone.utc)
+    last = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    conn = FakeConn([("t1", "song", first, last, 7)])
+
+    assert track_listens(conn, "t1") == TrackListens("t1", "song", first, last, 7)
+    assert conn.queries[0][1] == ["t1"]
+
+
+def test_track_listens_unknown_track():
+    assert track_listens(FakeConn([]), "missing") is None
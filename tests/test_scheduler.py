@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from scheduler import (
+    MAX_INTERVAL_MIN,
+    MIN_INTERVAL_MIN,
+    fill_gap,
+    is_due,
+    next_interval,
+)
+
+NOW = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+
+
+class FakeCursor:
+    def __init__(self, row):
+        self.row = row
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeSpotify:
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.calls = []
+
+    def current_user_recently_played(self, limit, before):
+        self.calls.append(before)
+        return {"items": self.pages.pop(0) if self.pages else []}
+
+
+def item(minutes_ago):
+    played_at = NOW - timedelta(minutes=minutes_ago)
+    return {"played_at": played_at.strftime("%Y-%m-%dT%H:%M:%S.000Z")}
+
+
+# ---------------------- next_interval ----------------------
+
+@pytest.mark.parametrize("rate", [0, -1, 0.001])
+def test_idle_uses_max_interval(rate):
+    assert next_interval(rate) == MAX_INTERVAL_MIN
+
+
+def test_heavy_listening_uses_min_interval():
+    assert next_interval(100) == MIN_INTERVAL_MIN
+
+
+def test_interval_fills_half_window():
+    # 2.5 reproducciones/min -> 25 reproducciones (media ventana) en 10 min
+    assert next_interval(2.5) == 10
+
+
+# ---------------------- is_due ----------------------
+
+def test_due_without_previous_runs():
+    assert is_due(FakeCursor(None), now=NOW)
+
+
+def test_not_due_before_margin():
+    cur = FakeCursor((NOW - timedelta(minutes=8), 10))
+    assert not is_due(cur, now=NOW)
+
+
+def test_due_within_one_minute_margin():
+    cur = FakeCursor((NOW - timedelta(minutes=9), 10))
+    assert is_due(cur, now=NOW)
+
+
+def test_due_after_interval():
+    cur = FakeCursor((NOW - timedelta(minutes=30), 10))
+    assert is_due(cur, now=NOW)
+
+
+# ---------------------- fill_gap ----------------------
+
+def test_fill_gap_stops_at_last_stored():
+    last_stored = NOW - timedelta(minutes=100)
+    # La segunda página llega hasta la última reproducción guardada (inclusive)
+    sp = FakeSpotify([[item(60), item(70)], [item(80), item(100), item(110)]])
+
+    recovered, filled = fill_gap(sp, NOW - timedelta(minutes=50), last_stored)
+
+    assert filled
+    assert [i["played_at"] for i in recovered] == [item(m)["played_at"] for m in (60, 70, 80)]
+    # La segunda página se pide antes de la reproducción más antigua de la primera
+    assert sp.calls[1] == int((NOW - timedelta(minutes=70)).timestamp() * 1000)
+
+
+def test_fill_gap_empty_page_is_not_filled():
+    sp = FakeSpotify([[item(60)]])
+    recovered, filled = fill_gap(sp, NOW - timedelta(minutes=50), NOW - timedelta(minutes=100))
+    assert not filled
+    assert len(recovered) == 1
+
+
+def test_fill_gap_respects_max_pages():
+    sp = FakeSpotify([[item(60)], [item(70)], [item(80)]])
+    recovered, filled = fill_gap(sp, NOW - timedelta(minutes=50), NOW - timedelta(minutes=100), max_pages=2)
+    assert not filled
+    assert len(recovered) == 2
+    assert len(sp.calls) == 2
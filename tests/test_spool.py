@@ -0,0 +1,147 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+import spool as spool_mod
+from spool import (
+    FAILED,
+    FLUSHED,
+    append_rows,
+    flush_to_postgres,
+    oldest_pending,
+    open_spool,
+    pending_count,
+    requeue_failed,
+)
+
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def row(played_at, track_name="track"):
+    data = {col: None for col in spool_mod.COLUMNS}
+    data.update(played_at=played_at, track_name=track_name)
+    return data
+
+
+@pytest.fixture
+def spool():
+    s = open_spool(":memory:")
+    yield s
+    s.close()
+
+
+def states(spool):
+    return dict(spool.execute("SELECT played_at, flushed FROM spool"))
+
+
+def test_flush_marks_rows_flushed(spool, monkeypatch):
+    inserted = []
+    monkeypatch.setattr(spool_mod, "execute_values", lambda cur, sql, values, page_size: inserted.extend(values))
+    append_rows(spool, [row("2026-10-19T10:00:00Z"), row("2026-10-19T10:05:00Z")])
+
+    assert flush_to_postgres(spool, FakeConn(), batch_size=1) == (2, 0)
+    assert len(inserted) == 2
+    assert pending_count(spool) == 0
+
+
+def test_bad_row_is_isolated(spool, monkeypatch):
+    def execute_values(cur, sql, values, page_size):
+        if any(value[1] == "bad" for value in values):
+            raise psycopg2.DataError("value too long")
+
+    monkeypatch.setattr(spool_mod, "execute_values", execute_values)
+    append_rows(spool, [
+        row("2026-10-19T10:00:00Z", "bad"),
+        row("2026-10-19T10:05:00Z"),
+        row("2026-10-19T10:10:00Z"),
+    ])
+
+    assert flush_to_postgres(spool, FakeConn(), batch_size=2) == (2, 1)
+    assert states(spool) == {
+        "2026-10-19T10:00:00Z": FAILED,
+        "2026-10-19T10:05:00Z": FLUSHED,
+        "2026-10-19T10:10:00Z": FLUSHED,
+    }
+    error = spool.execute("SELECT error FROM spool WHERE flushed = ?", (FAILED,)).fetchone()[0]
+    assert "value too long" in error
+
+
+def test_connection_error_propagates(spool, monkeypatch):
+    def execute_values(cur, sql, values, page_size):
+        raise psycopg2.OperationalError("server closed the connection")
+
+    monkeypatch.setattr(spool_mod, "execute_values", execute_values)
+    append_rows(spool, [row("2026-10-19T10:00:00Z")])
+
+    with pytest.raises(psycopg2.OperationalError):
+        flush_to_postgres(spool, FakeConn())
+    assert pending_count(spool) == 1
+
+
+def test_oldest_pending_uses_spooled_at(spool):
+    # Una reproducción antigua recién guardada no cuenta como atascada
+    append_rows(spool, [row("2026-10-01T10:00:00Z"), row("2026-10-01T10:05:00.123Z")])
+
+    oldest = oldest_pending(spool)
+
+    assert datetime.now(timezone.utc) - oldest < timedelta(minutes=1)
+
+
+def test_oldest_pending_orders_by_spooled_at(spool):
+    append_rows(spool, [row("2026-10-19T10:00:00Z"), row("2026-10-19T10:05:00Z")])
+    with spool:
+        spool.execute("UPDATE spool SET spooled_at = '2026-10-19T11:00:00.000000Z' WHERE played_at = '2026-10-19T10:00:00Z'")
+        spool.execute("UPDATE spool SET spooled_at = '2026-10-19T10:30:00.500000Z' WHERE played_at = '2026-10-19T10:05:00Z'")
+
+    assert oldest_pending(spool) == datetime(2026, 10, 19, 10, 30, 0, 500000, tzinfo=timezone.utc)
+
+
+def test_requeue_failed(spool, monkeypatch):
+    def execute_values(cur, sql, values, page_size):
+        raise psycopg2.DataError("bad value")
+
+    monkeypatch.setattr(spool_mod, "execute_values", execute_values)
+    append_rows(spool, [row("2026-10-19T10:00:00Z")])
+    assert flush_to_postgres(spool, FakeConn()) == (0, 1)
+    assert pending_count(spool) == 0
+
+    assert requeue_failed(spool) == 1
+    assert pending_count(spool) == 1
+    assert spool.execute("SELECT error FROM spool").fetchone()[0] is None
+
+
+def test_open_spool_migrates_old_schema(tmp_path):
+    path = str(tmp_path / "spool.sqlite3")
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE spool (played_at TEXT PRIMARY KEY, payload TEXT NOT NULL, flushed INTEGER NOT NULL DEFAULT 0)")
+    old.execute("INSERT INTO spool (played_at, payload) VALUES ('2026-10-19T10:00:00Z', '{}')")
+    old.commit()
+    old.close()
+
+    s = open_spool(path)
+    assert oldest_pending(s) is not None
+    s.close()